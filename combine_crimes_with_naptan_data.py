@@ -8,14 +8,26 @@ NaPTAN data source: https://beta-naptan.dft.gov.uk/Download/National
 """
 # # # # IMPORTS # # # #
 # sys
+import hashlib
 import pathlib 
 import os
-from typing import Tuple, Dict 
+import re
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Tuple, Dict, List 
 from datetime import datetime
 
 # 3rd party
+import numpy as np
 import pandas as pd 
 import geopandas as gpd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyogrio
+import pyproj
+import shapely
+from dateutil.relativedelta import relativedelta
+from numba import njit, prange
 from tqdm import tqdm
 
     
@@ -27,8 +39,58 @@ GEOMETRY_COL = "geometry"
 
 NAPTAN_BUFFER_M = 100  # Buffer around NaPTAN stops (metres)
 
+PROJECTED_CRS = "EPSG:27700"  # British National Grid (metres)
+
+JOIN_CHUNK_SIZE = 1_000_000  # Crime points queried against NaPTAN stops at once
+
+CRIME_LOOKBACK_MONTHS = 12  # Only the newest n months of crime data are used
+
 GROUPBY_COLS = ["NaptanCode", "Crime type"]
 
+# NaPTAN stop attributes reported alongside the crime counts
+NAPTAN_ATTR_COLS = [
+    "NaptanCode", "ATCOCode", "CommonName", "Landmark", "Street", 
+    "NptgLocalityCode", "LocalityName", "Status", "CreationDateTime", 
+    "ModificationDateTime",
+    ]
+
+# Low-cardinality crime data columns, read as dictionary (categorical) columns
+CRIME_CATEGORICAL_COLS = [
+    "Crime type", "Reported by", "Falls within", "LSOA code", "LSOA name",
+    "Last outcome category",
+    ]
+
+COORD_COLUMN_TYPES = {"Longitude": pa.float64(), "Latitude": pa.float64()}
+
+# Stop codes are identifiers, so are always read as strings
+NAPTAN_COLUMN_TYPES = {
+    **COORD_COLUMN_TYPES,
+    "NaptanCode": pa.string(),
+    "ATCOCode": pa.string(),
+    }
+
+CRIME_COLUMN_TYPES = {
+    **COORD_COLUMN_TYPES,
+    "Month": pa.string(),  # 'YYYY-MM', compared as a string against cutoffs
+    **{col: pa.dictionary(pa.int32(), pa.string()) for col in CRIME_CATEGORICAL_COLS},
+    }
+
+# Columns read from the CSVs, all others are dropped at read time
+CRIME_KEEP_COLS = [
+    "Crime ID", "Month", "Reported by", "Falls within", "Longitude", 
+    "Latitude", "Location", "LSOA code", "LSOA name", "Crime type", 
+    "Last outcome category",
+    ]
+NAPTAN_KEEP_COLS = NAPTAN_ATTR_COLS + ["Longitude", "Latitude"]
+
+# Bump when a change to reading / conversion changes the cached crime data
+CRIME_CACHE_VERSION = 2
+
+# Tags crime Parquet caches, so they are rebuilt when the read schema changes
+CRIME_CACHE_TAG = hashlib.md5(
+    repr((CRIME_CACHE_VERSION, CRIME_KEEP_COLS, CRIME_COLUMN_TYPES)).encode()
+    ).hexdigest()[:8]
+
 # # # # CLASSES # # # # 
 # TODO(JH): Class to handle all data loading?
 
@@ -41,12 +103,15 @@ def read_naptan_data(
         x_col: str,
         y_col: str,
         crs: str,
+        target_crs: str=None,
         export_geo: bool=False,
     ) -> gpd.GeoDataFrame:
     """
     Reads in NaPTAN data and converts to GeoSpatial format
     
-    Exports GeoSpatial NaPTAN data if `export_geo` is True
+    Coordinates are projected to `target_crs`, if passed
+    
+    Exports the combined GeoSpatial NaPTAN data if `export_geo` is True
     """
     
     stops_files = [
@@ -55,28 +120,34 @@ def read_naptan_data(
         if ".csv" in filename
         ]
     
+    # Stack all stop files, so geometries are created in a single call
+    frames = []
     for file in stops_files:
         
         print(f"Reading NaPTAN: {file}")
-        stop_data = pd.read_csv(
-            data_dir / file,
-            low_memory=False,
-            )
-        
-        geo_stop_data = create_geospatial_dataset(
-            df=stop_data, 
-            x_col=x_col,
-            y_col=y_col,
-            crs=crs,
+        frames.append(
+            read_csv(
+                filepath=data_dir / file,
+                column_types=NAPTAN_COLUMN_TYPES,
+                columns=NAPTAN_KEEP_COLS,
+                )
             )
+    
+    geo_stop_data = create_geospatial_dataset(
+        df=pd.concat(frames, ignore_index=True), 
+        x_col=x_col,
+        y_col=y_col,
+        crs=crs,
+        target_crs=target_crs,
+        )
+    
+    if export_geo:
+        filename = "geo_naptan.gpkg"
         
-        if export_geo:
-            filename = "geo_" + file.replace(".csv", ".gpkg")
-            
-            print(f"Exporting Geo NaPTAN data: {filename}")
-            geo_stop_data.to_file(data_dir / filename)
-        
-        return geo_stop_data
+        print(f"Exporting Geo NaPTAN data: {filename}")
+        export_geo_data(gdf=geo_stop_data, filepath=data_dir / filename)
+    
+    return geo_stop_data
         
         
 def read_and_create_geo_data(
@@ -84,13 +155,19 @@ def read_and_create_geo_data(
         x_col: str,
         y_col: str,
         crs: str,
+        target_crs: str=None,
+        lookback_months: int=None,
         export_geo: bool=False,
     ) -> Tuple[pd.DataFrame, Dict]:
     
     """
     Reads in all data from crime data downloads
     
-    Converts data to GeoSpatial format. 
+    If `lookback_months` is passed, only the `lookback_months` monthly 
+        directories up to and including the newest month in `data_dir` 
+        are read
+    
+    Converts data to GeoSpatial format, projected to `target_crs` if passed. 
     
     If `export_geo`, each GeoSpatial version of crime data will be exported 
         to the directory containing the raw crime data
@@ -107,110 +184,379 @@ def read_and_create_geo_data(
     # Get subdirectories of data
     crime_data_directories = os.listdir(data_dir)
     
-    # Variables to store data
-    all_data = {}
-    combined_data = pd.DataFrame()
-    
-    pbar = tqdm(
-        total=len(crime_data_directories),
-        desc="Reading data",
-        ncols=100,
-        leave=True,
-        position=0,
-        )
+    # Skip stale months before any I/O (directory names are ISO sortable)
+    cutoff = None
+    month_directories = [
+        directory
+        for directory in crime_data_directories
+        if re.fullmatch(r"\d{4}-\d{2}", directory)
+        ]
+    if lookback_months is not None and month_directories:
+        cutoff = cutoff_month(
+            latest_month=max(month_directories),
+            lookback_months=lookback_months,
+            )
+        crime_data_directories = [
+            directory
+            for directory in month_directories
+            if directory >= cutoff
+            ]
     
-    # Loads data
+    # Collect every (year, name, path) up front so files can be read in parallel
+    crime_data_files = []
     for directory in crime_data_directories:
 
         # Get year from directory name (format: YYYY-MM)
         year = directory[:4]
-        
-        if year not in all_data.keys():
-            all_data[year]= dict()
 
         # Create year-month specific path
-        path = CRIME_DATA_PATH / directory
+        path = data_dir / directory
         
-        crime_data_files = [
-            filename  
+        crime_data_files += [
+            (year, filename.replace(".csv", ""), path / filename)
             for filename in os.listdir(path)
             if ".csv" in filename
         ]
-        
-        # Read all crime data files for sub directory
-        for file in crime_data_files:
-            pbar.set_description(f"Reading: {file}")
-            
-            data = pd.read_csv(path / file)
-            
-            data = create_geospatial_dataset(
-                df=data,
-                x_col=x_col,
-                y_col=y_col,
-                crs=crs,
+    
+    if not crime_data_files:
+        raise ValueError(
+            f"No crime data CSVs found in {data_dir}"
+            + (f" for months from {cutoff}" if cutoff else "")
+            )
+    
+    load_file = partial(
+        read_crime_file,
+        x_col=x_col,
+        y_col=y_col,
+        crs=crs,
+        target_crs=target_crs,
+        min_month=cutoff,
+        export_geo=export_geo,
+        )
+    
+    # Reading and arrow parsing release the GIL, so threads scale with cores
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        frames = list(
+            tqdm(
+                executor.map(load_file, [path for _, _, path in crime_data_files]),
+                total=len(crime_data_files),
+                desc="Reading data",
+                ncols=100,
+                leave=True,
+                position=0,
                 )
+            )
+    
+    # Store the data
+    all_data = {}
+    for (year, name, _), data in zip(crime_data_files, frames):
+        all_data.setdefault(year, dict())[name] = data
+    
+    # Concatenate once, rather than re-copying a growing frame per file
+    combined_data = gpd.GeoDataFrame(
+        pd.concat(frames, ignore_index=True),
+        geometry=GEOMETRY_COL,
+        crs=target_crs or crs,
+        )
+    
+    # Per-file categories differ, so concat falls back to object columns
+    for col in CRIME_CATEGORICAL_COLS:
+        if col in combined_data.columns:
+            combined_data[col] = combined_data[col].astype("category")
+    
+    return all_data, combined_data
 
-            if export_geo:
-                data.to_file(path / ("geo_" + file.replace(".csv", ".gpkg")))
-            
-            # Store the data
-            all_data[year][file.replace(".csv", "")] = data       
-            combined_data = pd.concat([combined_data, data])
+
+def read_crime_file(
+        filepath: pathlib.Path,
+        x_col: str,
+        y_col: str,
+        crs: str,
+        target_crs: str=None,
+        min_month: str=None,
+        export_geo: bool=False,
+    ) -> gpd.GeoDataFrame:
+    """
+    Reads a single crime data CSV and converts to GeoSpatial format
+    
+    If `min_month` ('YYYY-MM') is passed, rows with an earlier `Month` are 
+        dropped. The cache always holds every row of the CSV
+    
+    The GeoSpatial data is cached as Parquet alongside the CSV, keyed by crs 
+        and `CRIME_CACHE_TAG`, and re-used while the cache is newer than the CSV
+    
+    Exports GeoSpatial crime data alongside the CSV if `export_geo` is True
+    """
+    
+    out_crs = target_crs or crs
+    cache_path = filepath.with_name(
+        f"{filepath.stem}_{out_crs.replace(':', '')}_{CRIME_CACHE_TAG}.parquet"
+        )
+    
+    if cache_path.exists() and cache_path.stat().st_mtime > filepath.stat().st_mtime:
+        data = gpd.read_parquet(
+            cache_path,
+            columns=CRIME_KEEP_COLS + [GEOMETRY_COL],
+            filters=None if min_month is None else [("Month", ">=", min_month)],
+            )
+    else:
+        data = read_csv(
+            filepath=filepath,
+            column_types=CRIME_COLUMN_TYPES,
+            columns=CRIME_KEEP_COLS,
+            )
         
-        # Update progress bar
-        pbar.update(n=1)
+        data = create_geospatial_dataset(
+            df=data,
+            x_col=x_col,
+            y_col=y_col,
+            crs=crs,
+            target_crs=target_crs,
+            )
+        
+        data.to_parquet(cache_path, compression="zstd")
+        
+        # Filtered after caching, so the cache is valid for any `min_month`
+        if min_month is not None:
+            data = data[data["Month"] >= min_month]
+
+    if export_geo:
+        export_geo_data(
+            gdf=data,
+            filepath=filepath.parent / ("geo_" + filepath.name.replace(".csv", ".gpkg")),
+            )
     
-    return all_data, combined_data
+    return data
 
     
+def read_csv(
+        filepath: pathlib.Path,
+        column_types: Dict=None,
+        columns: List[str]=None,
+    ) -> pd.DataFrame:
+    """
+    Reads a CSV with the multi-threaded pyarrow CSV reader
+    
+    `column_types` maps column names to pyarrow types, columns not present 
+        in the file are ignored. Empty values are read as null
+    
+    If `columns` is passed, only those columns are read (as nulls if missing 
+        from the file)
+    """
+    
+    table = pacsv.read_csv(
+        filepath,
+        read_options=pacsv.ReadOptions(use_threads=True),
+        convert_options=pacsv.ConvertOptions(
+            column_types=column_types,
+            include_columns=columns,
+            include_missing_columns=columns is not None,
+            strings_can_be_null=True,  # Blank strings read as null, as in pandas
+            ),
+        )
+    
+    return table.to_pandas()
+    
+
+def export_geo_data(
+        gdf: gpd.GeoDataFrame,
+        filepath: pathlib.Path,
+    ) -> None:
+    """
+    Exports `gdf` to a GeoPackage at `filepath` with pyogrio
+    
+    The GeoPackage spatial index is not built on write, as building it 
+        dominates write time for the large per-month exports
+    """
+    
+    pyogrio.write_dataframe(
+        gdf,
+        filepath,
+        driver="GPKG",
+        layer_options={"SPATIAL_INDEX": "NO"},
+        )
+    
+
 def create_geospatial_dataset(
         df: pd.DataFrame,
         x_col: str,
         y_col: str,
         crs: str,
+        target_crs: str=None,
     ) -> gpd.GeoDataFrame:
+    """
+    Creates a GeoDataFrame of points from the `x_col` and `y_col` columns
+    
+    Rows with missing / non-numeric coordinates are dropped so that every
+        returned row has a valid geometry
+    
+    If `target_crs` is passed, the coordinate arrays are projected from `crs`
+        to `target_crs` before the geometries are created
+    """
+    
+    # Cast coordinates to contiguous float64 arrays for vectorised creation
+    x = np.ascontiguousarray(pd.to_numeric(df[x_col], errors="coerce").to_numpy(dtype="float64"))
+    y = np.ascontiguousarray(pd.to_numeric(df[y_col], errors="coerce").to_numpy(dtype="float64"))
+    
+    # Drop rows without valid coordinates
+    valid = np.isfinite(x) & np.isfinite(y)
+    if not valid.all():
+        df = df.loc[valid]
+        x = x[valid]
+        y = y[valid]
+    
+    # Project raw coordinate arrays in one batch, rather than per geometry
+    if target_crs is not None and target_crs != crs:
+        transformer = pyproj.Transformer.from_crs(crs, target_crs, always_xy=True)
+        x, y = transformer.transform(x, y)
+        crs = target_crs
     
     # Create geometry from coordinates
-    df["geometry"] = gpd.points_from_xy(
-        x=df[x_col],
-        y=df[y_col],
+    geometry = gpd.GeoSeries(
+        shapely.points(x, y),
+        index=df.index,
         crs=crs,
-        ) 
+        )
     
-    # Create GeoDataFrame
-    geo_df = gpd.GeoDataFrame(
+    return gpd.GeoDataFrame(
         data=df,
-        geometry=df["geometry"],
+        geometry=geometry,
         crs=crs,
         )
+
+
+def naptan_tree_arrays(naptan_data: gpd.GeoDataFrame) -> Dict[str, np.ndarray]:
+    """
+    Returns the NaPTAN stop arrays used to build the stop STRtree, in 
+        Hilbert order:
+            x, y: stop coordinates
+            codes: dense int32 NaptanCode keys into `uniques`
+            uniques: NaptanCode for each key
+    """
+    
+    codes, uniques = pd.factorize(naptan_data["NaptanCode"], sort=False)
+    hilbert = naptan_data.geometry.hilbert_distance(level=16).to_numpy()
     
-    if geo_df.crs != crs:
-        geo_df = geo_df.to_crs(crs)
+    # Stops without a NaptanCode cannot be reported, so are dropped
+    order = np.flatnonzero(codes >= 0)
+    order = order[np.argsort(hilbert[order], kind="stable")]
+    points = naptan_data.geometry.values[order]
     
-    return geo_df
+    return {
+        "x": shapely.get_x(points),
+        "y": shapely.get_y(points),
+        "codes": codes[order].astype(np.int32),
+        "uniques": np.asarray(uniques, dtype=object),
+        }
 
 
-def apply_point_buffer(
-        gdf: gpd.GeoDataFrame,
+def count_crimes_near_stops(
+        crime_data: gpd.GeoDataFrame,
+        stop_arrays: Dict[str, np.ndarray],
         buffer_m: int,
-        geom_col: str,
-    ) -> gpd.GeoDataFrame:
+        chunk_size: int=JOIN_CHUNK_SIZE,
+    ) -> pd.DataFrame:
     """
-    Converts to EPSG:27700 and applies a buffer around each point 
-      within `gdf` with radius `radius_m`
+    Counts crimes of each type within `buffer_m` metres of each NaPTAN stop
+    
+    `stop_arrays` are the NaPTAN stop arrays from `naptan_tree_arrays`.
+    
+    Both datasets must be points in a projected (metre) crs. Candidates come
+        from a shapely STRtree of each stop's `buffer_m` bounding box and are
+        refined with a plain distance check, so no buffer polygons or joined
+        GeoDataFrame are created
+    
+    Crimes are streamed through the tree `chunk_size` points at a time into
+        a running count, so peak memory is bounded by the chunk size rather 
+        than the number of matched (crime, stop) pairs
+    
+    Returns a `crime_count` for each `GROUPBY_COLS` pair with crimes
     """
     
-    print(f"Applying point buffer of {buffer_m} metres")
+    stop_x = stop_arrays["x"]
+    stop_y = stop_arrays["y"]
+    stop_codes = stop_arrays["codes"]
+    stop_uniques = stop_arrays["uniques"]
+    tree = shapely.STRtree(
+        shapely.box(stop_x - buffer_m, stop_y - buffer_m, stop_x + buffer_m, stop_y + buffer_m),
+        node_capacity=16,
+        )
+    
+    # Dense integer keys, so the matched pairs are counted without hashing strings
+    ctype_codes, ctype_uniques = pd.factorize(crime_data["Crime type"], sort=False)
+    ctype_codes = ctype_codes.astype(np.int8 if len(ctype_uniques) < 128 else np.int32)
+    n_ctypes = len(ctype_uniques)
     
-    if gdf.crs != "EPSG:27700":
-        gdf = gdf.to_crs("EPSG:27700")
+    # Query in Hilbert order, so consecutive queries walk the same tree nodes
+    hilbert_order = np.argsort(
+        crime_data.geometry.hilbert_distance(level=16).to_numpy(),
+        kind="stable",
+        )
+    crime_points = crime_data.geometry.values[hilbert_order]
+    crime_x = shapely.get_x(crime_points)
+    crime_y = shapely.get_y(crime_points)
+    ctype_codes = ctype_codes[hilbert_order]
+    
+    counts = np.zeros((len(stop_uniques), n_ctypes), dtype=np.int32)
+    for start in range(0, len(crime_points), chunk_size):
+        # Bounding box candidates, refined to those within `buffer_m`
+        crime_idx, stop_idx = tree.query(crime_points[start:start + chunk_size])
+        crime_idx += start
         
-    if gdf.crs != "EPSG:27700":
-        raise f"Error: GDF could not be converted from {gdf.crs} to EPSG:27700"
-    else:
-        gdf[f"buffered_{geom_col}"] = gdf[geom_col].buffer(buffer_m)
-        print(f"Buffer created on {len(gdf):,} points from '{geom_col}' as 'buffered_{geom_col}'")
-        return gdf
+        within = within_distance(
+            crime_x[crime_idx], 
+            crime_y[crime_idx], 
+            stop_x[stop_idx], 
+            stop_y[stop_idx], 
+            float(buffer_m) ** 2,
+            )
+        crime_idx = crime_idx[within]
+        stop_idx = stop_idx[within]
+        
+        matched_stops = stop_codes[stop_idx]
+        matched_ctypes = ctype_codes[crime_idx]
+        
+        has_keys = matched_ctypes >= 0
+        np.add.at(counts, (matched_stops[has_keys], matched_ctypes[has_keys]), 1)
+    
+    stops, ctypes = np.nonzero(counts)
+    
+    return pd.DataFrame({
+        GROUPBY_COLS[0]: stop_uniques[stops],
+        GROUPBY_COLS[1]: np.asarray(ctype_uniques)[ctypes],
+        "crime_count": counts[stops, ctypes],
+        })
+
+
+@njit(parallel=True, cache=True)
+def within_distance(
+        cx: np.ndarray,
+        cy: np.ndarray,
+        sx: np.ndarray,
+        sy: np.ndarray,
+        max_dist_sq: float,
+    ) -> np.ndarray:
+    """
+    Returns a mask of whether each point (`cx`, `cy`) is within 
+        sqrt(`max_dist_sq`) of the paired point (`sx`, `sy`)
+    """
+    
+    out = np.empty(len(cx), dtype=np.bool_)
+    for i in prange(len(cx)):
+        dx = cx[i] - sx[i]
+        dy = cy[i] - sy[i]
+        out[i] = dx * dx + dy * dy <= max_dist_sq
+    
+    return out
+
+
+def cutoff_month(latest_month: str, lookback_months: int) -> str:
+    """
+    Returns the first month ('YYYY-MM') of the `lookback_months` month window 
+        ending at (and including) `latest_month`
+    """
+    latest = datetime.strptime(latest_month, "%Y-%m")
+    return (latest - relativedelta(months=lookback_months - 1)).strftime("%Y-%m")
 
 
 def ct()-> str:
@@ -221,25 +567,20 @@ def ct()-> str:
 def check_crs(gdf: gpd.GeoDataFrame, crs: str) -> gpd.GeoDataFrame:
     """
     Checks that `gdf` has passed `crs`
-    else, tries to cast to `crs` before returning
+    else, casts to `crs` before returning
+    
+    A `gdf` without a crs is assumed to already be in `crs`
     """
     
-    if gdf.crs == crs:
-        return gdf
+    if gdf.crs is None:
+        return gdf.set_crs(crs)
     
-    if gdf.crs != crs:
-        print(f"Detected crs:{gdf.crs}, transforming to: {crs}")
-        gdf = gdf.to_crs(crs)
-        
-    if gdf.crs == crs:
+    # Compares the CRS definitions, not their string formatting
+    if gdf.crs.equals(pyproj.CRS(crs)):
         return gdf
     
-    gdf = gdf.to_crs(crs)
-    
-    if gdf.crs == crs:
-        return gdf
-    else:
-        raise f"ERROR: Could not convert gdf from {gdf.crs} to {crs}"
+    print(f"Detected crs:{gdf.crs}, transforming to: {crs}")
+    return gdf.to_crs(crs)
 
 
 # # # # PROCESS # # # #
@@ -253,6 +594,8 @@ def main():
         x_col="Longitude",
         y_col="Latitude",
         crs="EPSG:4326",
+        target_crs=PROJECTED_CRS,
+        lookback_months=CRIME_LOOKBACK_MONTHS,
         export_geo=False, 
         )    
     print(f"Crime data created for {len(combined_crime_data):,} offences.")
@@ -263,64 +606,37 @@ def main():
         x_col="Longitude",
         y_col="Latitude",
         crs="EPSG:4326",
+        target_crs=PROJECTED_CRS,
         export_geo=False,
         )
     print(f"NaPTAN data loaded for {len(naptan_data):,} PT stops.")
     
-    #### Clean data (remove NaN's etc) - remove NaN's within functions?
+    #### Clean data (NaN coordinates are dropped in create_geospatial_dataset)
     # TODO(JH): Check columns like "status" in naptan data
-    naptan_data = naptan_data[naptan_data[GEOMETRY_COL].notna()]
-    combined_crime_data = combined_crime_data[combined_crime_data[GEOMETRY_COL].notna()]
     
-    # Remove crime data > 12 months old
-    print("Removing combined crime data for crimes > 12 months ago.")
     
+    #### Perform spatial join (crimes within NAPTAN_BUFFER_M of each stop)
+    # Distances are in metres, so both datasets must be in PROJECTED_CRS
+    naptan_data = check_crs(gdf=naptan_data, crs=PROJECTED_CRS)
+    combined_crime_data = check_crs(gdf=combined_crime_data, crs=PROJECTED_CRS)
     
-    #### Buffer NaPTAN stops with radius
-    naptan_data = apply_point_buffer(
-        gdf=naptan_data,
-        buffer_m=NAPTAN_BUFFER_M,
-        geom_col=GEOMETRY_COL,
-        )    
-    
+    stop_arrays = naptan_tree_arrays(naptan_data=naptan_data)
     
-    #### Perform spatial join
-    
-    # Currently has two geometries, drop one and set buffered as geometry
-    naptan_data = naptan_data.drop(columns=[GEOMETRY_COL])
-    naptan_data = gpd.GeoDataFrame(
-        data=naptan_data,
-        geometry=f"buffered_{GEOMETRY_COL}",
+    print(f"Commening spatial join: {ct()}")
+    crimes_per_stop = count_crimes_near_stops(
+        crime_data=combined_crime_data,
+        stop_arrays=stop_arrays,
+        buffer_m=NAPTAN_BUFFER_M,
         )
+    print(f"Spatial join complete: {ct()}")
     
-    naptan_data = check_crs(gdf=naptan_data, crs="EPSG:27700")
-    combined_crime_data = check_crs(gdf=combined_crime_data, crs="EPSG:27700")
-    
-    print(f"Commening sjoin: {ct()}")
-    crime_near_naptan_stops = gpd.sjoin(
-        how="inner",
-        left_df=combined_crime_data,
-        right_df=naptan_data,
-        predicate="within",
-        )
-    crime_near_naptan_stops["crime_count"] = 1
-    print(f"sjoin complete: {ct()}")
-       
-    
-    crimes_per_stop = crime_near_naptan_stops.drop(
-        columns=[GEOMETRY_COL]
-        ).groupby(GROUPBY_COLS).sum()
-    
-    crimes_per_stop_filtered = crimes_per_stop[
-        [
-            "crime_count", "Crime ID", "Month", "Reported by", "Falls within",
-            "Location", "LSOA code", "LSOA name", "Last outcome category",
-            "ATCOCode", "CommonName", "Landmark", "Street", "NptgLocalityCode",
-            "LocalityName", "Status", "CreationDateTime", "ModificationDateTime"
-            ]
-        ]
+    #### Add NaPTAN stop attributes to the crime counts
+    crimes_per_stop = naptan_data[NAPTAN_ATTR_COLS].drop_duplicates(
+        "NaptanCode"
+        ).merge(crimes_per_stop, on="NaptanCode")
     
-    print(f"\n{len(crimes_per_stop_filtered):,} stops have crime within "
+    n_stops = crimes_per_stop["NaptanCode"].nunique()
+    print(f"\n{n_stops:,} stops have crime within "
           f"{NAPTAN_BUFFER_M} metres of NaPTAN stops {ct()}")
     
 if __name__ == "__main__":